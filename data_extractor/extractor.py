@@ -1,19 +1,156 @@
+import asyncio
+import csv
 import requests
 import pandas as pd
-from typing import List, Dict, Any, Optional
-import json
+from typing import List, Dict, Any, Optional, Callable, Tuple, Union, Iterator
+import logging
+import os
+import shelve
+import ssl
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, suppress
 from datetime import datetime
-from urllib.parse import urlencode, urlparse
+from itertools import chain
+from urllib.parse import quote_plus, urlparse
 import urllib3
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import jmespath
+except ImportError:
+    jmespath = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+logger = logging.getLogger(__name__)
+
+KeyAccessor = Tuple[str, Callable[[Any], Any]]
+
+# Key paths starting with this prefix are JMESPath expressions rather
+# than plain dotted paths.
+JMESPATH_PREFIX = 'jmespath:'
+
+# Values openpyxl can store directly; anything else (dicts, lists) is
+# written as its string form, matching the CSV output.
+EXCEL_CELL_TYPES = (str, int, float, bool, type(None))
+
+
+def _decode_json(content: bytes, charset: Optional[str]) -> Any:
+    """
+    Parse a JSON response body. Bytes go straight to json_loads unless the
+    response declares a charset other than UTF-8. Decode failures raise
+    ValueError (JSONDecodeError / UnicodeDecodeError) or LookupError for an
+    unknown charset.
+    """
+    if charset and charset.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+        content = content.decode(charset)
+    return json_loads(content)
+
+
+def _compile_key_path(key_path: str) -> Callable[[Any], Any]:
+    """
+    Build an accessor for a key path. Plain dotted paths walk a pre-split
+    tuple; 'accountInternalId' segments are read from the first element of
+    a list, e.g. accounts.accountInternalId. Paths prefixed with
+    'jmespath:' are compiled with jmespath, e.g.
+    jmespath:accounts[*].accountInternalId.
+    """
+    if key_path.startswith(JMESPATH_PREFIX):
+        if jmespath is None:
+            raise ImportError(f"jmespath is required for key path '{key_path}'")
+        expression = jmespath.compile(key_path[len(JMESPATH_PREFIX):])
+
+        def search(obj: Any) -> Any:
+            try:
+                return expression.search(obj)
+            except jmespath.exceptions.JMESPathError:
+                return None
+        return search
+
+    parts = tuple(key_path.split('.'))
+
+    if 'accountInternalId' not in parts:
+        def get_value(obj: Any) -> Any:
+            current = obj
+            for part in parts:
+                if not isinstance(current, dict):
+                    return None
+                current = current.get(part)
+            return current
+        return get_value
+
+    def get_value_with_lists(obj: Any) -> Any:
+        current = obj
+        for part in parts:
+            if isinstance(current, dict):
+                current = current.get(part)
+            elif isinstance(current, list) and part == 'accountInternalId':
+                first = current[0] if current else None
+                current = first.get(part) if isinstance(first, dict) else None
+            else:
+                return None
+        return current
+    return get_value_with_lists
+
+
+class _SSLContextAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter that hands one shared SSLContext to every connection pool
+    instead of letting urllib3 build a new context per connection.
+    """
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        proxy_kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+
 class MSISDNRequestExtractor:
-    def __init__(self, base_url: str, headers: Dict[str, str] = None):
+    RETRY_TOTAL = 3
+    RETRY_BACKOFF_FACTOR = 1
+    RETRY_STATUS_FORCELIST = (500, 502, 503, 504)
+    REQUEST_TIMEOUT = 30
+
+    def __init__(self, base_url: str, headers: Dict[str, str] = None,
+                 max_concurrency: int = 64, cache_size: int = 100_000,
+                 etag_store: str = None):
         """
-        Initialize the extractor with base URL and optional headers.
+        Initialize the extractor with base URL, optional headers, the
+        maximum number of requests allowed in flight at once and the number
+        of responses kept in memory (0 disables caching). When etag_store
+        is a file path, responses are persisted there with their ETag and
+        revalidated with If-None-Match on later runs.
         """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.cache_size = cache_size
         self.base_url = self._validate_url(base_url)
+        separator = '&' if '?' in self.base_url else '?'
+        self._url_prefix = f"{self.base_url}{separator}is-personal-details-embedded=true&msisdn="
         default_headers = {
             'Content-Type': 'application/json',
             'Accept': 'application/json',
@@ -26,7 +163,11 @@ class MSISDNRequestExtractor:
             default_headers.update(headers)
         self.headers = default_headers
         
+        self.ssl_context = self._create_ssl_context()
         self.session = self._configure_session()
+        self._response_cache: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._etag_store = shelve.open(etag_store) if etag_store else None
+        self._etag_lock = threading.Lock()
         
     def _validate_url(self, url: str) -> str:
         """
@@ -40,70 +181,148 @@ class MSISDNRequestExtractor:
             raise ValueError("URL must start with 'http://' or 'https://'")
         return url
         
+    def _create_ssl_context(self) -> ssl.SSLContext:
+        """
+        Build the TLS context shared by all connections. Certificate
+        verification stays disabled, as before.
+        """
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
     def _configure_session(self) -> requests.Session:
         session = requests.Session()
         retry_strategy = urllib3.Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[500, 502, 503, 504],
+            total=self.RETRY_TOTAL,
+            backoff_factor=self.RETRY_BACKOFF_FACTOR,
+            status_forcelist=list(self.RETRY_STATUS_FORCELIST),
             allowed_methods=["GET", "HEAD", "OPTIONS"]
         )
-        adapter = requests.adapters.HTTPAdapter(max_retries=retry_strategy)
+        adapter = _SSLContextAdapter(
+            self.ssl_context,
+            pool_connections=self.max_concurrency,
+            pool_maxsize=self.max_concurrency,
+            max_retries=retry_strategy,
+            pool_block=False
+        )
         session.mount("http://", adapter)
         session.mount("https://", adapter)
+        session.headers.update(self.headers)
         return session
     
-    def read_msisdns(self, input_file: str, msisdn_column: str) -> List[str]:
+    def _read_excel(self, input_file: str, **kwargs) -> pd.DataFrame:
+        """
+        Read an Excel file with the Rust-backed calamine engine, falling back
+        to openpyxl (xlsx) or pandas' default engine (xls) when
+        python-calamine is not installed.
+        """
+        try:
+            return pd.read_excel(input_file, engine='calamine', **kwargs)
+        except ImportError:
+            engine = 'openpyxl' if input_file.lower().endswith('.xlsx') else None
+            return pd.read_excel(input_file, engine=engine, **kwargs)
+
+    def iter_msisdn_batches(self, input_file: str, msisdn_column: str,
+                            batch_size: int = 10_000) -> Iterator[List[str]]:
+        """
+        Yield valid MSISDNs in batches of at most batch_size rows. CSV input
+        is streamed in chunks; Excel input is read once and then sliced.
+        """
         try:
             if not input_file or not msisdn_column:
                 raise ValueError("Input file path and MSISDN column name are required")
                 
+            usecols = lambda column: column == msisdn_column
             if input_file.lower().endswith('.csv'):
-                df = pd.read_csv(input_file)
+                chunks = pd.read_csv(input_file, usecols=usecols, dtype=str, engine='c',
+                                     chunksize=batch_size)
             elif input_file.lower().endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(input_file, engine='openpyxl')
+                df = self._read_excel(input_file, usecols=usecols, dtype=str)
+                if msisdn_column not in df.columns:
+                    raise ValueError(f"Column '{msisdn_column}' not found in the file")
+                chunks = (df.iloc[i:i + batch_size] for i in range(0, len(df), batch_size))
             else:
                 raise ValueError("Unsupported file format. Use CSV or Excel files.")
-                
-            if msisdn_column not in df.columns:
-                raise ValueError(f"Column '{msisdn_column}' not found in the file")
-                
-            msisdns = df[msisdn_column].astype(str).str.strip()
-            valid_msisdns = [m for m in msisdns if m.isdigit()]
-            if not valid_msisdns:
+
+            found = False
+            for chunk in chunks:
+                if msisdn_column not in chunk.columns:
+                    raise ValueError(f"Column '{msisdn_column}' not found in the file")
+                msisdns = chunk[msisdn_column].dropna().str.strip()
+                valid_msisdns = msisdns[msisdns.str.fullmatch(r'\d+', na=False)].tolist()
+                if valid_msisdns:
+                    found = True
+                    yield valid_msisdns
+            if not found:
                 raise ValueError("No valid MSISDNs found in the file")
-            return valid_msisdns
         except Exception as e:
             print(f"Error reading file: {e}")
             raise
 
+    def read_msisdns(self, input_file: str, msisdn_column: str) -> List[str]:
+        return [msisdn for batch in self.iter_msisdn_batches(input_file, msisdn_column)
+                for msisdn in batch]
+
+    def close(self) -> None:
+        """
+        Close the HTTP session and flush the ETag store, if any.
+        """
+        self.session.close()
+        if self._etag_store is not None:
+            with self._etag_lock:
+                self._etag_store.close()
+            self._etag_store = None
+
+    def _get_etag_entry(self, msisdn: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        if self._etag_store is None:
+            return None
+        with self._etag_lock:
+            return self._etag_store.get(msisdn)
+
+    def _save_etag_entry(self, msisdn: str, etag: Optional[str],
+                         json_data: Dict[str, Any]) -> None:
+        if self._etag_store is None or not etag:
+            return
+        with self._etag_lock:
+            self._etag_store[msisdn] = (etag, json_data)
+
+    def _get_etag_entries(self, msisdns: List[str]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        if self._etag_store is None:
+            return {}
+        with self._etag_lock:
+            return {m: self._etag_store[m] for m in msisdns if m in self._etag_store}
+
+    def _save_etag_entries(self, entries: Dict[str, Tuple[str, Dict[str, Any]]]) -> None:
+        if self._etag_store is None or not entries:
+            return
+        with self._etag_lock:
+            self._etag_store.update(entries)
+
     def make_request(self, msisdn: str) -> Optional[Dict[str, Any]]:
         if not msisdn or not msisdn.isdigit():
             print(f"Invalid MSISDN format: {msisdn}")
             return None
         try:
-            params = {
-                'is-personal-details-embedded': 'true',
-                'msisdn': msisdn,
-
-            }
-            url = f"{self.base_url}?{urlencode(params)}"
-            print(f"\nRequesting URL: {url}")
-            
-            headers = self.headers.copy()
-            headers['Msisdn'] = msisdn  
-            
-            print("Request Headers:", headers)
+            url = self._url_prefix + quote_plus(msisdn)
+            headers = {'Msisdn': msisdn}
+            etag_entry = self._get_etag_entry(msisdn)
+            if etag_entry:
+                headers['If-None-Match'] = etag_entry[0]
             response = self.session.get(
                 url,
                 headers=headers,
                 verify=False,  
-                timeout=30
+                timeout=self.REQUEST_TIMEOUT
             )
-            print("Response Status Code:", response.status_code)
-            print("Response Content:", response.text)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("GET %s -> %s: %s", url, response.status_code, response.text)
+            if response.status_code == 304 and etag_entry:
+                return etag_entry[1]
             response.raise_for_status()
-            return response.json()
+            json_data = _decode_json(response.content, response.encoding)
+            self._save_etag_entry(msisdn, response.headers.get('ETag'), json_data)
+            return json_data
         except requests.exceptions.HTTPError as e:
             print(f"HTTP Error for MSISDN {msisdn}: {e}")
             if e.response.status_code == 400:
@@ -118,68 +337,284 @@ class MSISDNRequestExtractor:
         except requests.exceptions.RequestException as e:
             print(f"Request Error for MSISDN {msisdn}: {e}")
             return None
-        except json.JSONDecodeError as e:
+        except (ValueError, LookupError) as e:
             print(f"JSON Decode Error for MSISDN {msisdn}: {e}")
             return None
-    def extract_data(self, json_data: Optional[Dict[str, Any]], keys: List[str], msisdn: str) -> Dict[str, Any]:
 
-        def get_nested_value(obj: Dict[str, Any], key_path: str) -> Any:
-            try:
-                parts = key_path.split('.')
-                current = obj
-                for part in parts:
-                    if isinstance(current, list): 
-                        if part == 'accountInternalId':  
-                            current = current[0].get(part, None)
-                        else:
-                            return None
-                    elif isinstance(current, dict):
-                        current = current.get(part)
-                    else:
-                        return None
-                return current
-            except Exception:
-                return None
+    async def _make_request_async(self, session: "aiohttp.ClientSession",
+                                  semaphore: asyncio.Semaphore, msisdn: str,
+                                  etag_entry: Optional[Tuple[str, Dict[str, Any]]],
+                                  etag_updates: Dict[str, Tuple[str, Dict[str, Any]]]
+                                  ) -> Optional[Dict[str, Any]]:
+        """
+        Async counterpart of make_request, retrying the same status codes
+        as the requests session. The ETag store is not touched here: the
+        stored entry is passed in and new ETags are collected in
+        etag_updates, so no disk I/O runs on the event loop per request.
+        """
+        if not msisdn or not msisdn.isdigit():
+            print(f"Invalid MSISDN format: {msisdn}")
+            return None
+        url = self._url_prefix + quote_plus(msisdn)
+        headers = {'Msisdn': msisdn}
+        if etag_entry:
+            headers['If-None-Match'] = etag_entry[0]
+        async with semaphore:
+            for attempt in range(self.RETRY_TOTAL + 1):
+                retries_left = attempt < self.RETRY_TOTAL
+                try:
+                    async with session.get(url, headers=headers) as response:
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("GET %s -> %s", url, response.status)
+                        if response.status in self.RETRY_STATUS_FORCELIST and retries_left:
+                            await asyncio.sleep(self.RETRY_BACKOFF_FACTOR * 2 ** attempt)
+                            continue
+                        if response.status == 304 and etag_entry:
+                            return etag_entry[1]
+                        response.raise_for_status()
+                        json_data = _decode_json(await response.read(), response.charset)
+                        etag = response.headers.get('ETag')
+                        if etag:
+                            etag_updates[msisdn] = (etag, json_data)
+                        return json_data
+                except aiohttp.ClientResponseError as e:
+                    print(f"HTTP Error for MSISDN {msisdn}: {e}")
+                    if e.status == 400:
+                        print("Check URL format and MSISDN validity")
+                    return None
+                except aiohttp.ClientConnectionError as e:
+                    if retries_left:
+                        await asyncio.sleep(self.RETRY_BACKOFF_FACTOR * 2 ** attempt)
+                        continue
+                    print(f"Connection Error for MSISDN {msisdn}: {e}")
+                    return None
+                except asyncio.TimeoutError as e:
+                    print(f"Timeout Error for MSISDN {msisdn}: {e}")
+                    return None
+                except aiohttp.ClientError as e:
+                    print(f"Request Error for MSISDN {msisdn}: {e}")
+                    return None
+                except (ValueError, LookupError) as e:
+                    print(f"JSON Decode Error for MSISDN {msisdn}: {e}")
+                    return None
+        return None
+
+    async def _fetch_responses_async(self, msisdns: List[str]) -> List[Optional[Dict[str, Any]]]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, ssl=self.ssl_context)
+        timeout = aiohttp.ClientTimeout(total=self.REQUEST_TIMEOUT)
+        # Read and write the ETag store once per batch, off the event loop
+        loop = asyncio.get_running_loop()
+        etag_entries = await loop.run_in_executor(None, self._get_etag_entries, msisdns)
+        etag_updates = {}
+        async with aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                         timeout=timeout) as session:
+            responses = await asyncio.gather(
+                *[self._make_request_async(session, semaphore, m, etag_entries.get(m),
+                                           etag_updates)
+                  for m in msisdns]
+            )
+        await loop.run_in_executor(None, self._save_etag_entries, etag_updates)
+        return responses
+
+    def fetch_responses(self, msisdns: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Fetch the API response for every MSISDN, preserving input order.
+        Each distinct MSISDN is requested once and successful responses are
+        kept in an LRU cache of cache_size entries, so repeats in later
+        batches are not requested again. Requests run concurrently when
+        aiohttp is installed, otherwise (or when called from inside a running
+        event loop) on a pool of max_concurrency threads.
+        """
+        responses = {}
+        pending = []
+        for msisdn in dict.fromkeys(msisdns):
+            cached = self._response_cache.get(msisdn)
+            if cached is None:
+                pending.append(msisdn)
+            else:
+                self._response_cache.move_to_end(msisdn)
+                responses[msisdn] = cached
+
+        if pending:
+            if aiohttp is None or self._event_loop_running():
+                with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    fetched = list(executor.map(self.make_request, pending))
+            else:
+                fetched = asyncio.run(self._fetch_responses_async(pending))
+            for msisdn, json_data in zip(pending, fetched):
+                responses[msisdn] = json_data
+                if json_data is not None:
+                    self._cache_response(msisdn, json_data)
+        return [responses[m] for m in msisdns]
+
+    @staticmethod
+    def _event_loop_running() -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    def _cache_response(self, msisdn: str, json_data: Dict[str, Any]) -> None:
+        if self.cache_size <= 0:
+            return
+        self._response_cache[msisdn] = json_data
+        if len(self._response_cache) > self.cache_size:
+            self._response_cache.popitem(last=False)
+
+    @staticmethod
+    def compile_key_paths(keys: List[str]) -> List[KeyAccessor]:
+        """
+        Pre-split dotted key paths into (key, accessor) pairs so they can be
+        reused across every response passed to extract_data.
+        """
+        return [(key, _compile_key_path(key)) for key in keys]
+
+    def extract_data(self, json_data: Optional[Dict[str, Any]],
+                     keys: Union[List[str], List[KeyAccessor]], msisdn: str) -> Dict[str, Any]:
+        if keys and isinstance(keys[0], str):
+            keys = self.compile_key_paths(keys)
 
         result = {'msisdn': msisdn}
         if json_data:
-            for key in keys:
-                result[key] = get_nested_value(json_data, key)
+            for key, accessor in keys:
+                result[key] = accessor(json_data)
         else:
-            for key in keys:
+            for key, _ in keys:
                 result[key] = None
         return result
 
+    def extract_batch(self, msisdns: List[str], responses: List[Optional[Dict[str, Any]]],
+                      keys: Union[List[str], List[KeyAccessor]]) -> Dict[str, List[Any]]:
+        """
+        Column-wise counterpart of extract_data: apply each key accessor
+        across the whole batch and return one list per output column.
+        """
+        if keys and isinstance(keys[0], str):
+            keys = self.compile_key_paths(keys)
+
+        columns = {'msisdn': list(msisdns)}
+        for key, accessor in keys:
+            columns[key] = [accessor(json_data) if json_data else None
+                            for json_data in responses]
+        return columns
 
+    def _replace_on_success(self, stack: ExitStack, output_file: str) -> str:
+        """
+        Return a temporary path next to output_file. When the stack closes
+        cleanly the temporary file replaces output_file; on error it is
+        removed and any existing output_file is left untouched. Register
+        this before entering the writer so the writer is closed first.
+        """
+        partial_file = f"{output_file}.partial"
 
-    def process_all_msisdns(self, input_file: str, msisdn_column: str,
-                            keys_to_extract: List[str], output_file: str = None):
+        def finish(exc_type, exc, tb) -> None:
+            if exc_type is None:
+                os.replace(partial_file, output_file)
+            else:
+                with suppress(FileNotFoundError):
+                    os.remove(partial_file)
+        stack.push(finish)
+        return partial_file
 
-        try:
-            msisdns = self.read_msisdns(input_file, msisdn_column)
-            results = []
-            total = len(msisdns)
-            print(f"\nTotal MSISDNs to process: {total}")
-            for idx, msisdn in enumerate(msisdns, 1):
-                print(f"\nProcessing MSISDN {idx}/{total}: {msisdn}")
-                json_data = self.make_request(msisdn)
-                extracted_data = self.extract_data(json_data, keys_to_extract, msisdn)
-                results.append(extracted_data)
+    def _open_output(self, stack: ExitStack, output_file: str,
+                     fieldnames: List[str]) -> Callable[[Dict[str, List[Any]]], None]:
+        """
+        Open output_file for streaming, write the header and return a
+        function that appends one batch of columns from extract_batch.
+        Parquet files are written row group by row group with pyarrow;
+        Excel workbooks are built in openpyxl's write-only mode and saved
+        when the stack closes without an error.
+        """
+        if output_file.lower().endswith('.parquet'):
+            if pa is None:
+                raise ImportError("pyarrow is required for Parquet output")
+            # Response field types are not known up front, so every column
+            # is stored as text, like the CSV output.
+            schema = pa.schema([(name, pa.string()) for name in fieldnames])
+            partial_file = self._replace_on_success(stack, output_file)
+            parquet_writer = stack.enter_context(
+                pq.ParquetWriter(partial_file, schema, compression='zstd'))
+
+            def write_parquet(columns: Dict[str, List[Any]]) -> None:
+                arrays = [pa.array([value if value is None or isinstance(value, str) else str(value)
+                                    for value in columns[name]], type=pa.string())
+                          for name in fieldnames]
+                parquet_writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            return write_parquet
+
+        if output_file.lower().endswith('.xlsx'):
+            from openpyxl import Workbook
+
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet()
+            sheet.append(fieldnames)
 
+            def save_workbook(exc_type, exc, tb) -> None:
+                # Leave any existing file alone if the run failed midway
+                if exc_type is None:
+                    workbook.save(output_file)
+                else:
+                    sheet.close()
+            stack.push(save_workbook)
+
+            def write_excel(columns: Dict[str, List[Any]]) -> None:
+                for row in zip(*columns.values()):
+                    sheet.append([value if isinstance(value, EXCEL_CELL_TYPES) else str(value)
+                                  for value in row])
+            return write_excel
+
+        partial_file = self._replace_on_success(stack, output_file)
+        handle = stack.enter_context(open(partial_file, 'w', newline='', encoding='utf-8'))
+        # Match the '\n' line endings DataFrame.to_csv wrote previously
+        writer = csv.writer(handle, lineterminator='\n')
+        writer.writerow(fieldnames)
+
+        def write_csv(columns: Dict[str, List[Any]]) -> None:
+            writer.writerows(zip(*columns.values()))
+        return write_csv
+
+    def process_all_msisdns(self, input_file: str, msisdn_column: str,
+                            keys_to_extract: List[str], output_file: str = None,
+                            batch_size: int = 10_000):
+        """
+        Fetch and extract data for every MSISDN in input_file, batch by batch.
+        Rows are appended to the output as each batch completes, so memory
+        stays bounded by batch_size for CSV, Excel and Parquet output. When
+        no output_file is given, Parquet is used if pyarrow is installed.
+        """
+        try:
             if not output_file:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                output_file = f"extracted_data_{timestamp}.csv"
-
-            df = pd.DataFrame(results)
-            if output_file.lower().endswith('.csv'):
-                df.to_csv(output_file, index=False)
-            elif output_file.lower().endswith(('.xlsx', '.xls')):
-                df.to_excel(output_file, index=False)
-            else:
+                extension = 'parquet' if pa is not None else 'csv'
+                output_file = f"extracted_data_{timestamp}.{extension}"
+            if output_file.lower().endswith('.xls'):
+                raise ValueError("Writing legacy .xls files is not supported. Use .xlsx instead.")
+            if not output_file.lower().endswith(('.csv', '.xlsx', '.parquet')):
                 output_file = f"{output_file}.csv"
-                df.to_csv(output_file, index=False)
+
+            compiled_keys = self.compile_key_paths(keys_to_extract)
+            fieldnames = list(dict.fromkeys(['msisdn'] + keys_to_extract))
+            total = 0
+            # Read and validate the first batch before the output file is
+            # opened, so a bad input never truncates an existing result.
+            batches = self.iter_msisdn_batches(input_file, msisdn_column, batch_size)
+            first_batch = next(batches)
+            with ExitStack() as stack:
+                write_batch = self._open_output(stack, output_file, fieldnames)
+                for msisdns in chain([first_batch], batches):
+                    print(f"\nProcessing MSISDNs {total + 1}-{total + len(msisdns)}")
+                    responses = self.fetch_responses(msisdns)
+                    columns = self.extract_batch(msisdns, responses, compiled_keys)
+                    write_batch(columns)
+                    total += len(msisdns)
+
+            if self._etag_store is not None:
+                with self._etag_lock:
+                    self._etag_store.sync()
             print(f"\nData saved to {output_file}")
-            print(f"Processed {len(results)} MSISDNs")
+            print(f"Processed {total} MSISDNs")
         except Exception as e:
             print(f"Error processing MSISDNs: {e}")
             raise
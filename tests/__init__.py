@@ -25,4 +25,437 @@ def test_msisdn_validation():
     # Test with None data
     result = extractor.extract_data(None, ["test.key"], "1234567890")
     assert result['msisdn'] == "1234567890"
-    assert result['test.key'] is None
\ No newline at end of file
+    assert result['test.key'] is None
+
+def test_max_concurrency_validation():
+    extractor = MSISDNRequestExtractor("https://example.com/api", max_concurrency=8)
+    assert extractor.max_concurrency == 8
+
+    with pytest.raises(ValueError):
+        MSISDNRequestExtractor("https://example.com/api", max_concurrency=0)
+
+def test_fetch_responses_skips_invalid_msisdns():
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    assert extractor.fetch_responses(["abc", ""]) == [None, None]
+
+def test_fetch_responses_inside_running_event_loop(monkeypatch):
+    import asyncio
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    monkeypatch.setattr(extractor, "make_request", lambda msisdn: {"id": msisdn})
+
+    async def caller():
+        return extractor.fetch_responses(["1", "2"])
+
+    # Falls back to the thread pool instead of nesting asyncio.run
+    assert asyncio.run(caller()) == [{"id": "1"}, {"id": "2"}]
+
+@pytest.fixture
+def aiohttp_api():
+    """
+    Serve a small aiohttp app on a background event loop. MSISDN 1 fails
+    with 503 once, 2 always returns 404, 3 honours If-None-Match, 4
+    returns a body that is not JSON, 5 a Latin-1 body declared as such and
+    6 invalid UTF-8.
+    """
+    import asyncio
+    import socket
+    import threading
+    web = pytest.importorskip("aiohttp.web")
+    seen = []
+
+    async def handler(request):
+        msisdn = request.query["msisdn"]
+        seen.append((msisdn, request.headers.get("If-None-Match")))
+        if msisdn == "1" and len([m for m, _ in seen if m == "1"]) == 1:
+            return web.Response(status=503)
+        if msisdn == "2":
+            return web.Response(status=404)
+        if msisdn == "3" and request.headers.get("If-None-Match") == '"v3"':
+            return web.Response(status=304)
+        if msisdn == "4":
+            return web.Response(text="not json")
+        if msisdn == "5":
+            return web.Response(body=b'{"a": "\xe9"}',
+                                content_type="application/json", charset="latin-1")
+        if msisdn == "6":
+            return web.Response(body=b'{"a": "\xe9"}', content_type="application/json")
+        return web.json_response({"id": msisdn}, headers={"ETag": f'"v{msisdn}"'})
+
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_get("/api", handler)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    loop.run_until_complete(web.SockSite(runner, sock).start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{port}/api", seen
+
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+def test_fetch_responses_async_path(aiohttp_api):
+    base_url, seen = aiohttp_api
+    extractor = MSISDNRequestExtractor(base_url)
+    extractor.RETRY_BACKOFF_FACTOR = 0
+
+    # 503 is retried, 404 and invalid JSON give None
+    assert extractor.fetch_responses(["1", "2", "3", "4"]) == [
+        {"id": "1"}, None, {"id": "3"}, None]
+    assert [m for m, _ in seen].count("1") == 2
+    assert [m for m, _ in seen].count("2") == 1
+
+def test_fetch_responses_async_decodes_without_orjson(aiohttp_api, monkeypatch):
+    import json
+    import data_extractor.extractor as extractor_module
+    monkeypatch.setattr(extractor_module, "json_loads", json.loads)
+    base_url, _ = aiohttp_api
+
+    extractor = MSISDNRequestExtractor(base_url)
+    assert extractor.fetch_responses(["5", "6"]) == [{"a": "\u00e9"}, None]
+
+def test_fetch_responses_async_revalidates_with_etag(aiohttp_api, tmp_path):
+    base_url, seen = aiohttp_api
+    store = str(tmp_path / "etags")
+
+    extractor = MSISDNRequestExtractor(base_url, etag_store=store)
+    assert extractor.fetch_responses(["3"]) == [{"id": "3"}]
+    assert seen[-1] == ("3", None)
+    extractor.close()
+
+    # A fresh extractor revalidates and gets the stored body on 304
+    extractor = MSISDNRequestExtractor(base_url, etag_store=store)
+    assert extractor.fetch_responses(["3"]) == [{"id": "3"}]
+    assert seen[-1] == ("3", '"v3"')
+    extractor.close()
+
+def test_session_configuration():
+    extractor = MSISDNRequestExtractor("https://example.com/api",
+                                       headers={"X-Api-Key": "secret"},
+                                       max_concurrency=16)
+    assert extractor.session.headers["X-Api-Key"] == "secret"
+    assert extractor.session.headers["Accept"] == "*/*"
+
+    adapter = extractor.session.get_adapter("https://example.com/api")
+    assert adapter._pool_maxsize == 16
+
+def test_fetch_responses_deduplicates_and_caches(monkeypatch):
+    import data_extractor.extractor as extractor_module
+    monkeypatch.setattr(extractor_module, "aiohttp", None)
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    calls = []
+
+    def fake_request(msisdn):
+        calls.append(msisdn)
+        return None if msisdn == "3" else {"id": msisdn}
+
+    monkeypatch.setattr(extractor, "make_request", fake_request)
+    responses = extractor.fetch_responses(["1", "2", "1", "3"])
+    assert responses == [{"id": "1"}, {"id": "2"}, {"id": "1"}, None]
+    assert sorted(calls) == ["1", "2", "3"]
+
+    # Cached successes are not requested again, failures are retried
+    extractor.fetch_responses(["2", "3"])
+    assert sorted(calls) == ["1", "2", "3", "3"]
+
+def test_extract_data_with_compiled_keys():
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    keys = extractor.compile_key_paths(
+        ["individualId", "details.name", "accounts.accountInternalId", "accounts.other"]
+    )
+    data = {"individualId": "1", "details": {"name": "x"},
+            "accounts": [{"accountInternalId": "123"}]}
+    result = extractor.extract_data(data, keys, "1234567890")
+    assert result == {"msisdn": "1234567890", "individualId": "1", "details.name": "x",
+                      "accounts.accountInternalId": "123", "accounts.other": None}
+
+    # Empty lists and non-dict leaves resolve to None
+    result = extractor.extract_data({"accounts": [], "details": "x"}, keys, "1")
+    assert result["accounts.accountInternalId"] is None
+    assert result["details.name"] is None
+
+def test_process_all_msisdns_writes_csv(tmp_path, monkeypatch):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("msisdn\n100\n101\n100\n")
+    output_file = tmp_path / "out.csv"
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    monkeypatch.setattr(extractor, "fetch_responses", lambda msisdns: [
+        None if m == "101" else {"a": {"b": m}, "c": [1]} for m in msisdns])
+    extractor.process_all_msisdns(str(input_file), "msisdn", ["a.b", "c"],
+                                  str(output_file), batch_size=2)
+
+    assert output_file.read_bytes() == b"msisdn,a.b,c\n100,100,[1]\n101,,\n100,100,[1]\n"
+
+def test_read_msisdns_excel(tmp_path):
+    import pandas as pd
+    input_file = str(tmp_path / "input.xlsx")
+    pd.DataFrame({"name": ["a", "b", "c"],
+                  "msisdn": ["123", "abc", " 456 "]}).to_excel(input_file, index=False)
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    assert extractor.read_msisdns(input_file, "msisdn") == ["123", "456"]
+
+def test_read_msisdns_csv(tmp_path):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("name,msisdn,other\na,0123,x\nb,,y\nc, 456 ,z\nd,12ab,w\n")
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    # Leading zeros survive because the column is read as text
+    assert extractor.read_msisdns(str(input_file), "msisdn") == ["0123", "456"]
+
+    with pytest.raises(ValueError):
+        extractor.read_msisdns(str(input_file), "missing")
+
+def test_iter_msisdn_batches(tmp_path):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("msisdn\n" + "\n".join(str(100 + i) for i in range(5)) + "\n")
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    batches = list(extractor.iter_msisdn_batches(str(input_file), "msisdn", batch_size=2))
+    assert batches == [["100", "101"], ["102", "103"], ["104"]]
+
+def test_response_cache_is_bounded(monkeypatch):
+    import data_extractor.extractor as extractor_module
+    monkeypatch.setattr(extractor_module, "aiohttp", None)
+    extractor = MSISDNRequestExtractor("https://example.com/api", cache_size=2)
+    calls = []
+
+    def fake_request(msisdn):
+        calls.append(msisdn)
+        return {"id": msisdn}
+
+    monkeypatch.setattr(extractor, "make_request", fake_request)
+    # Duplicates within a batch are answered even when they exceed the cache
+    assert extractor.fetch_responses(["1", "2", "3", "1"]) == [
+        {"id": "1"}, {"id": "2"}, {"id": "3"}, {"id": "1"}]
+    assert list(extractor._response_cache) == ["2", "3"]
+
+    extractor.fetch_responses(["3", "1"])
+    assert sorted(calls) == ["1", "1", "2", "3"]
+
+def test_request_url_prefix():
+    extractor = MSISDNRequestExtractor("https://example.com/api?")
+    assert extractor._url_prefix == (
+        "https://example.com/api?is-personal-details-embedded=true&msisdn=")
+
+    extractor = MSISDNRequestExtractor("https://example.com/api?key=1&")
+    assert extractor._url_prefix == (
+        "https://example.com/api?key=1&is-personal-details-embedded=true&msisdn=")
+
+def test_make_request_decodes_without_orjson(monkeypatch):
+    import json
+    import data_extractor.extractor as extractor_module
+    monkeypatch.setattr(extractor_module, "json_loads", json.loads)
+
+    class FakeResponse:
+        status_code = 200
+        headers = {}
+        text = ""
+
+        def __init__(self, content, encoding):
+            self.content = content
+            self.encoding = encoding
+
+        def raise_for_status(self):
+            pass
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    replies = [FakeResponse(b'{"a": "\xe9"}', "utf-8"),
+               FakeResponse(b'{"a": "\xe9"}', "ISO-8859-1"),
+               FakeResponse(b'{"a": 1}', "no-such-charset")]
+    monkeypatch.setattr(extractor.session, "get", lambda url, **kwargs: replies.pop(0))
+
+    # Invalid UTF-8 is a decode error, a declared charset is honoured
+    assert extractor.make_request("1") is None
+    assert extractor.make_request("1") == {"a": "\u00e9"}
+    assert extractor.make_request("1") is None
+
+def test_make_request_revalidates_with_etag(tmp_path, monkeypatch):
+    class FakeResponse:
+        encoding = None
+
+        def __init__(self, status_code, content=b"", etag=None):
+            self.status_code = status_code
+            self.content = content
+            self.text = content.decode()
+            self.headers = {"ETag": etag} if etag else {}
+
+        def raise_for_status(self):
+            pass
+
+    store = str(tmp_path / "etags")
+    sent_headers = []
+    replies = [FakeResponse(200, b'{"id": "1"}', etag='"v1"'), FakeResponse(304)]
+
+    extractor = MSISDNRequestExtractor("https://example.com/api", etag_store=store)
+    def fake_get(url, headers, **kwargs):
+        sent_headers.append(headers)
+        return replies.pop(0)
+    monkeypatch.setattr(extractor.session, "get", fake_get)
+    assert extractor.make_request("1") == {"id": "1"}
+    extractor.close()
+
+    # A fresh extractor revalidates and serves the stored body on 304
+    extractor = MSISDNRequestExtractor("https://example.com/api", etag_store=store)
+    monkeypatch.setattr(extractor.session, "get", fake_get)
+    assert extractor.make_request("1") == {"id": "1"}
+    assert "If-None-Match" not in sent_headers[0]
+    assert sent_headers[1]["If-None-Match"] == '"v1"'
+    extractor.close()
+
+def test_extract_batch_matches_extract_data():
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    keys = ["individualId", "accounts.accountInternalId"]
+    responses = [{"individualId": "1", "accounts": [{"accountInternalId": "a"}]}, None]
+
+    columns = extractor.extract_batch(["100", "101"], responses, keys)
+    assert columns == {"msisdn": ["100", "101"], "individualId": ["1", None],
+                       "accounts.accountInternalId": ["a", None]}
+    rows = [extractor.extract_data(r, keys, m) for m, r in zip(["100", "101"], responses)]
+    assert [dict(zip(columns, values)) for values in zip(*columns.values())] == rows
+
+def test_session_shares_ssl_context():
+    import ssl
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    assert extractor.ssl_context.verify_mode == ssl.CERT_NONE
+
+    adapter = extractor.session.get_adapter("https://example.com/api")
+    assert adapter.poolmanager.connection_pool_kw["ssl_context"] is extractor.ssl_context
+
+def test_process_all_msisdns_writes_excel(tmp_path, monkeypatch):
+    import pandas as pd
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("msisdn\n100\n101\n102\n")
+    output_file = tmp_path / "out.xlsx"
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    monkeypatch.setattr(extractor, "fetch_responses", lambda msisdns: [
+        None if m == "101" else {"a": {"b": 1}, "c": [1]} for m in msisdns])
+    extractor.process_all_msisdns(str(input_file), "msisdn", ["a.b", "c"],
+                                  str(output_file), batch_size=2)
+
+    df = pd.read_excel(output_file, dtype=str)
+    assert list(df.columns) == ["msisdn", "a.b", "c"]
+    assert df["msisdn"].tolist() == ["100", "101", "102"]
+    assert df["c"].tolist()[0] == "[1]"
+
+def test_extract_data_with_jmespath_keys():
+    pytest.importorskip("jmespath")
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    data = {"accounts": [{"accountInternalId": "1", "status": "active"},
+                         {"accountInternalId": "2", "status": "closed"}],
+            "a&b": 1}
+    keys = ["jmespath:accounts[*].accountInternalId",
+            "jmespath:accounts[?status=='closed'].accountInternalId | [0]",
+            "jmespath:length(accounts)",
+            "accounts.accountInternalId", "a&b"]
+
+    result = extractor.extract_data(data, keys, "100")
+    assert result["jmespath:accounts[*].accountInternalId"] == ["1", "2"]
+    assert result["jmespath:accounts[?status=='closed'].accountInternalId | [0]"] == "2"
+    assert result["jmespath:length(accounts)"] == 2
+    # Keys without the prefix stay plain dotted paths
+    assert result["accounts.accountInternalId"] == "1"
+    assert result["a&b"] == 1
+
+    # Runtime JMESPath errors (e.g. length() of null) resolve to None
+    result = extractor.extract_data({"accounts": None}, keys, "101")
+    assert result["jmespath:length(accounts)"] is None
+    result = extractor.extract_data({"other": 1}, keys, "102")
+    assert result["jmespath:length(accounts)"] is None
+
+def test_process_all_msisdns_writes_parquet(tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("msisdn\n100\n101\n102\n")
+    output_file = tmp_path / "out.parquet"
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    monkeypatch.setattr(extractor, "fetch_responses", lambda msisdns: [
+        None if m == "101" else {"a": {"b": 1}, "c": "x"} for m in msisdns])
+    extractor.process_all_msisdns(str(input_file), "msisdn", ["a.b", "c"],
+                                  str(output_file), batch_size=2)
+
+    table = pq.read_table(output_file)
+    assert table.column_names == ["msisdn", "a.b", "c"]
+    assert table.to_pydict() == {"msisdn": ["100", "101", "102"],
+                                 "a.b": ["1", None, "1"], "c": ["x", None, "x"]}
+
+@pytest.mark.parametrize("input_text", [None, "msisdn\nabc\n", "other\n100\n"])
+def test_process_all_msisdns_keeps_output_on_invalid_input(tmp_path, input_text):
+    input_file = tmp_path / "input.csv"
+    if input_text is not None:
+        input_file.write_text(input_text)
+    output_file = tmp_path / "out.csv"
+    output_file.write_text("previous results\n")
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    with pytest.raises((FileNotFoundError, ValueError)):
+        extractor.process_all_msisdns(str(input_file), "msisdn", ["a"], str(output_file))
+    assert output_file.read_text() == "previous results\n"
+
+def test_process_all_msisdns_keeps_excel_on_failure(tmp_path, monkeypatch):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("msisdn\n100\n101\n")
+    output_file = tmp_path / "out.xlsx"
+    output_file.write_bytes(b"previous results")
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    def failing_fetch(msisdns):
+        if msisdns == ["101"]:
+            raise RuntimeError("boom")
+        return [None] * len(msisdns)
+    monkeypatch.setattr(extractor, "fetch_responses", failing_fetch)
+
+    with pytest.raises(RuntimeError):
+        extractor.process_all_msisdns(str(input_file), "msisdn", ["a"],
+                                      str(output_file), batch_size=1)
+    assert output_file.read_bytes() == b"previous results"
+
+def test_import_without_openpyxl():
+    import os
+    import subprocess
+    import sys
+    code = ("import sys; sys.modules['openpyxl'] = None; "
+            "from data_extractor import MSISDNRequestExtractor")
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=repo_root)
+
+@pytest.mark.parametrize("extension", ["csv", "parquet"])
+def test_process_all_msisdns_keeps_output_on_failure(tmp_path, monkeypatch, extension):
+    if extension == "parquet":
+        pytest.importorskip("pyarrow")
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("msisdn\n100\n101\n")
+    output_file = tmp_path / f"out.{extension}"
+    output_file.write_bytes(b"previous results")
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    def failing_fetch(msisdns):
+        if msisdns == ["101"]:
+            raise RuntimeError("boom")
+        return [None] * len(msisdns)
+    monkeypatch.setattr(extractor, "fetch_responses", failing_fetch)
+
+    with pytest.raises(RuntimeError):
+        extractor.process_all_msisdns(str(input_file), "msisdn", ["a"],
+                                      str(output_file), batch_size=1)
+    assert output_file.read_bytes() == b"previous results"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["input.csv", output_file.name]
+
+def test_process_all_msisdns_rejects_xls_output(tmp_path):
+    input_file = tmp_path / "input.csv"
+    input_file.write_text("msisdn\n100\n")
+    output_file = tmp_path / "out.xls"
+
+    extractor = MSISDNRequestExtractor("https://example.com/api")
+    with pytest.raises(ValueError):
+        extractor.process_all_msisdns(str(input_file), "msisdn", ["a"], str(output_file))
+    assert not output_file.exists()